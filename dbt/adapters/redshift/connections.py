@@ -217,6 +217,7 @@ class RedshiftConnectMethodFactory:
             "workgroup": self.credentials.workgroup,
             "secret_arn": self.credentials.secret_arn,
             "iam_role": self.credentials.role,
+            "region": self.credentials.region,
         }
 
         if self.credentials.secret_arn or self.credentials.serverless:
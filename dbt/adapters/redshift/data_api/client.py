@@ -1,13 +1,47 @@
 import logging
+import random
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from itertools import chain
-from typing import List, Optional
+from operator import itemgetter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 from botocore.client import BaseClient
 from botocore.exceptions import ClientError
 
 log = logging.getLogger(__name__)
 
+# batch_execute_statement takes at most 40 sqls
+MAX_SQLS_PER_BATCH = 40
+
+# statement polling starts fast and backs off exponentially up to a cap
+_INITIAL_POLL_SECONDS = 0.05
+_MAX_POLL_SECONDS = 2.0
+_POLL_BACKOFF = 1.6
+
+# backoff when the active statements quota is exhausted
+_INITIAL_SUBMIT_BACKOFF_SECONDS = 0.5
+_MAX_SUBMIT_BACKOFF_SECONDS = 10.0
+_SUBMIT_BACKOFF_JITTER_SECONDS = 0.25
+
+# how many resolved result ids to remember for statements whose results were never fetched
+_MAX_CACHED_RESULT_IDS = 128
+
+
+def _decode_row(row: List[Dict]) -> Tuple:
+    """Turns a raw record into a tuple of its values, a Field holds a single value or isNull"""
+    return tuple([None if "isNull" in column else next(iter(column.values())) for column in row])
+
+
+def _retry_after(ex: ClientError) -> Optional[float]:
+    """Seconds the server asked us to wait before retrying, if it said so"""
+    headers = ex.response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+    try:
+        return max(float(headers["retry-after"]), 0.0)
+    except (KeyError, ValueError):
+        return None
+
 
 class RedshiftQueryException(Exception):
     def __init__(self, id_: str, status: str, error: str) -> None:
@@ -39,91 +73,332 @@ class RedshiftDataClient:
         }
         self.database = database
         self.client = client
+        # every statement is submitted with the same connection details
+        self._base_kwargs = {**self._connection_details, "Database": database}
+        # statement id -> id holding its results, resolved while waiting
+        self._result_ids: Dict[str, str] = {}
 
-    def execute_sqls(self, sqls: List[str], wait: bool = True, timeout_seconds: int = 120) -> str:
+    def execute_sqls(
+        self, sqls: List[str], wait: bool = True, timeout_seconds: float = 120
+    ) -> str:
         assert (
-            len(sqls) <= 40
-        ), "Cannot execute more than 40 queries in one call, use execute_sqls_batched instead"
+            len(sqls) <= MAX_SQLS_PER_BATCH
+        ), f"Cannot execute more than {MAX_SQLS_PER_BATCH} queries in one call, use execute_sqls_batched instead"
+        deadline = time.monotonic() + timeout_seconds
+        attempt = 0
         while True:
             try:
-                args = {**self._connection_details, "Database": self.database, "Sqls": sqls}
-                resp = self.client.batch_execute_statement(**args)
-                log.info("queued [%s]", sqls)
+                resp = self.client.batch_execute_statement(**dict(self._base_kwargs, Sqls=sqls))
                 id_ = resp["Id"]
-                print(f"executing {sqls}")
+                if log.isEnabledFor(logging.INFO):
+                    log.info("queued [%s] as [%s]", sqls, id_)
                 break
             except ClientError as ex:
                 if ex.response["Error"]["Code"] == "ActiveStatementsExceededException":
                     # we hit a query limit ( should be around 200 )
-                    log.debug("got ActiveStatementsExceededException, sleeping for 10 sec")
-                    if timeout_seconds < 0:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
                         raise RuntimeError(
                             "timed out while trying to execute query [ActiveStatementsExceededException]"
                         )
-                    timeout_seconds -= 10
-                    time.sleep(10)
+                    # slots free up as soon as other queries finish, retry quickly at first
+                    # but never sooner than the server asked us to
+                    delay = min(
+                        _MAX_SUBMIT_BACKOFF_SECONDS,
+                        _INITIAL_SUBMIT_BACKOFF_SECONDS * 2**attempt,
+                    ) + random.uniform(0, _SUBMIT_BACKOFF_JITTER_SECONDS)
+                    retry_after = _retry_after(ex)
+                    if retry_after is not None:
+                        delay = max(delay, retry_after)
+                    delay = min(delay, remaining)
+                    log.debug(
+                        "got ActiveStatementsExceededException, sleeping for %.2f sec", delay
+                    )
+                    time.sleep(delay)
+                    attempt += 1
                     continue
                 raise ex
         if wait:
-            self._wait(id_, timeout_seconds, 1)
+            self._wait(id_, max(deadline - time.monotonic(), 0))
         return id_
 
     def execute_sql(self, sql, wait: bool = True, timeout_seconds: int = 120) -> str:
         return self.execute_sqls(sqls=[sql], wait=wait, timeout_seconds=timeout_seconds)
 
+    def execute_sqls_batched(
+        self,
+        sqls: List[str],
+        concurrency: int = 5,
+        batch_size: int = MAX_SQLS_PER_BATCH,
+        wait: bool = True,
+        timeout_seconds: int = 120,
+    ) -> "WaitGroup":
+        """Split sqls into batches of at most batch_size and run at most concurrency of them at
+        once, submitting the next batches as running ones finish. The returned group holds the
+        statement id of every batch in order, with wait=False it returns once the last batches
+        are submitted and the caller can wait on it later. timeout_seconds covers submitting and
+        waiting together"""
+        assert (
+            0 < batch_size <= MAX_SQLS_PER_BATCH
+        ), f"batch_size must be in (0, {MAX_SQLS_PER_BATCH}]"
+        assert concurrency > 0, "concurrency must be positive"
+        deadline = time.monotonic() + timeout_seconds
+        batches = [sqls[i : i + batch_size] for i in range(0, len(sqls), batch_size)]
+
+        group = WaitGroup(self, max_workers=concurrency)
+        submitted = 0
+        while submitted < len(batches):
+            # keep at most concurrency batches running, a failed or timed out wait cancels them
+            running = group.wait_until(concurrency - 1, max(deadline - time.monotonic(), 0))
+            window = batches[submitted : submitted + concurrency - running]
+            try:
+                ids = self._submit_all(
+                    window, max(deadline - time.monotonic(), 0), max_workers=len(window)
+                )
+            except Exception:
+                group.cancel()
+                raise
+            for id_ in ids:
+                group.add(id_)
+            submitted += len(window)
+        if wait:
+            group.wait_all(max(deadline - time.monotonic(), 0))
+        return group
+
+    def gather_execute_sqls(
+        self, sqls_list: List[List[str]], timeout_seconds: int = 120
+    ) -> List[str]:
+        """Submit every batch before waiting on any, so independent batches run concurrently
+        server side and the total wait is close to the slowest one rather than the sum"""
+        deadline = time.monotonic() + timeout_seconds
+        ids = self._submit_all(sqls_list, timeout_seconds)
+        WaitGroup(self, ids).wait_all(max(deadline - time.monotonic(), 0))
+        return ids
+
+    def _submit_all(
+        self, sqls_list: List[List[str]], timeout_seconds: float, max_workers: int = 1
+    ) -> List[str]:
+        """Submit every list of sqls without waiting on them, max_workers at a time. If a submit
+        fails the statements that did go through are cancelled before raising, as nobody would
+        wait on them"""
+        failed = threading.Event()
+
+        def submit(sqls: List[str]) -> Optional[str]:
+            # once a submit failed don't start the ones still queued
+            if failed.is_set():
+                return None
+            try:
+                return self.execute_sqls(sqls, wait=False, timeout_seconds=timeout_seconds)
+            except Exception:
+                failed.set()
+                raise
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(submit, sqls) for sqls in sqls_list]
+        ids: List[str] = []
+        error: Optional[BaseException] = None
+        for future in futures:
+            exc = future.exception()
+            if exc is not None:
+                error = error or exc
+                continue
+            id_ = future.result()
+            if id_ is not None:
+                ids.append(id_)
+        if error is not None:
+            for id_ in ids:
+                self._cancel(id_)
+            raise error
+        return ids
+
     def row_count(self, id_: str):
         resp = self.client.describe_statement(Id=id_)
         if resp["SubStatements"]:
             return resp["SubStatements"][-1]["ResultRows"]
         return resp["ResultRows"]
 
-    def result_set(self, id_: str):
-        """Results columnMetadata and an iterator for the rows as tuples"""
-        resp = self.client.describe_statement(Id=id_)
-        if resp["SubStatements"]:
-            id_ = resp["SubStatements"][-1]["Id"]
-        paginator = self.client.get_paginator("get_statement_result")
-        pages = iter(paginator.paginate(Id=id_))
-        # get first page
-        first_page = next(pages)
-
-        def iterator():
-            for page in chain([first_page], pages):
-                for row in page["Records"]:
-                    yield tuple(
-                        None if "isNull" in column else next(iter(column.values()))
-                        for column in row
-                    )
+    def first_page(self, id_: str) -> Tuple[str, Dict[str, Any]]:
+        """The id holding the statement's results and the raw first page of them, enough to
+        know the result's columns without setting up row iteration"""
+        result_id = self._result_ids.pop(id_, None)
+        if result_id is None:
+            result_id = self._result_id(self.client.describe_statement(Id=id_))
+        # get_statement_result has no page size, the server fills pages up to its own limit,
+        # so follow NextToken directly rather than through a paginator
+        return result_id, self.client.get_statement_result(Id=result_id)
 
-        return first_page["ColumnMetadata"], iterator()
-
-    def _wait(self, id_: str, timeout_seconds: int = 120, check_internal_seconds=2):
-        total = 0
-        sleep_time = 0.1
-        assert check_internal_seconds >= sleep_time, f"check_internal_seconds must be at least {sleep_time}"
-        while total < timeout_seconds:
-            resp = self.client.describe_statement(Id=id_)
-            status = resp["Status"].upper()
-            # happy scenario first
-            if status == "FINISHED":
-                # success
-                return resp.get("ResultsRows", 0)
-            if status in ("SUBMITTED", "PICKED", "STARTED"):
-                # in progress
-                time.sleep(sleep_time)
-                total += sleep_time
-                # increase sleep time 
-                sleep_time = min(sleep_time*2,check_internal_seconds)
-                continue
-            if status in ("ABORTED", "FAILED"):
-                raise RedshiftQueryException(id_, status, resp["Error"])
+    def result_set(self, id_: str, prefetched: Optional[Tuple[str, Dict[str, Any]]] = None):
+        """Results columnMetadata and an iterator for the rows as tuples, prefetched is what
+        first_page(id_) returned if the caller already fetched it"""
+        result_id, page = prefetched or self.first_page(id_)
+        metadata = page["ColumnMetadata"]
+        return metadata, map(_decode_row, self._records(result_id, page))
+
+    def _records(self, result_id: str, page: Dict[str, Any]) -> Iterator[List[Dict]]:
+        """Raw records of every page of a result, starting from its already fetched first page"""
+        return chain.from_iterable(map(itemgetter("Records"), self._pages(result_id, page)))
+
+    def _pages(self, result_id: str, page: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """page and every page after it"""
+        if not page.get("NextToken"):
+            # single page, nothing to prefetch
+            yield page
+            return
+        # fetch the next page in the background while the current one is consumed
+        executor = ThreadPoolExecutor(max_workers=1)
+        next_page: Optional[Future] = None
+        try:
+            while True:
+                next_token = page.get("NextToken")
+                if not next_token:
+                    yield page
+                    return
+                next_page = executor.submit(
+                    self.client.get_statement_result, Id=result_id, NextToken=next_token
+                )
+                yield page
+                page = next_page.result()
+        finally:
+            # when the consumer stops early don't make it wait for a page it will never read
+            if next_page is not None:
+                next_page.cancel()
+            executor.shutdown(wait=False)
+
+    @staticmethod
+    def _result_id(resp) -> str:
+        """The id to fetch results with, the last sub statement for batches"""
+        if resp.get("SubStatements"):
+            return resp["SubStatements"][-1]["Id"]
+        return resp["Id"]
+
+    def _wait(
+        self,
+        id_: str,
+        timeout_seconds: float = 120,
+        initial_interval_seconds: float = _INITIAL_POLL_SECONDS,
+        max_interval_seconds: float = _MAX_POLL_SECONDS,
+    ):
+        assert (
+            0 < initial_interval_seconds <= max_interval_seconds
+        ), "initial_interval_seconds must be positive and at most max_interval_seconds"
+        start = time.monotonic()
+        deadline = start + timeout_seconds
+        sleep_time = initial_interval_seconds
+        while True:
+            result_id = self._check_status(id_, self.client.describe_statement(Id=id_))
+            if result_id is not None:
+                return result_id
+            # in progress, back off exponentially so short queries return fast
+            # and long queries don't hammer the api
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(sleep_time, remaining))
+            sleep_time = min(sleep_time * _POLL_BACKOFF, max_interval_seconds)
+        self._cancel(id_)
+        raise RuntimeError(f"query [{id_}] timed out after [{time.monotonic() - start:.1f}s]")
 
+    def _check_status(self, id_: str, resp: Dict[str, Any]) -> Optional[str]:
+        """The result id once the statement finished, None while it is still running"""
+        status = resp["Status"].upper()
+        # happy scenario first
+        if status == "FINISHED":
+            # success, remember where the results live so result_set can skip a describe
+            result_id = self._result_id(resp)
+            if len(self._result_ids) >= _MAX_CACHED_RESULT_IDS:
+                # drop the oldest entry, dicts keep insertion order
+                self._result_ids.pop(next(iter(self._result_ids)), None)
+            self._result_ids[id_] = result_id
+            return result_id
+        if status in ("ABORTED", "FAILED"):
+            raise RedshiftQueryException(id_, status, resp["Error"])
+        if status not in ("SUBMITTED", "PICKED", "STARTED"):
             raise RuntimeError(f"query [{id_}] invalid status [{status}]")
-        # timeout
-        # cancel the statement if possible, ignoring all errors
-        # if the query is actually successfull the cancel will be an error... so w/e
+        return None
+
+    def _cancel(self, id_: str) -> None:
+        # cancel the statement so it stops holding an active statement slot,
+        # if the query finished in the meantime the cancel fails and that is fine
         try:
-            self.client.cancel_statement(Id=str)
-        except Exception:
-            pass
-        raise RuntimeError(f"query [{id_}] timed out after [{total}]")
+            self.client.cancel_statement(Id=id_)
+        except ClientError as ex:
+            log.debug("could not cancel query [%s]: %s", id_, ex)
+
+
+class WaitGroup:
+    """Statements being waited on together, each poll describes all pending statements at once
+    so polling many statements costs about as much wall time as polling one"""
+
+    def __init__(
+        self, client: RedshiftDataClient, ids: Iterable[str] = (), max_workers: int = 8
+    ) -> None:
+        self._client = client
+        self._max_workers = max_workers
+        # statement id -> last seen status, in submission order
+        self.statuses: Dict[str, Optional[str]] = {id_: None for id_ in ids}
+
+    @property
+    def ids(self) -> List[str]:
+        return list(self.statuses)
+
+    def add(self, id_: str) -> None:
+        self.statuses[id_] = None
+
+    def wait_all(self, timeout_seconds: float = 120) -> None:
+        self.wait_until(0, timeout_seconds)
+
+    def wait_until(self, max_pending: int, timeout_seconds: float = 120) -> int:
+        """Wait until at most max_pending statements are still running and return how many are.
+        On failure or timeout the running statements are cancelled"""
+        start = time.monotonic()
+        deadline = start + timeout_seconds
+        sleep_time = _INITIAL_POLL_SECONDS
+        pending = self._pending()
+        if len(pending) <= max_pending:
+            return len(pending)
+        describe = self._client.client.describe_statement
+        with ThreadPoolExecutor(max_workers=min(self._max_workers, len(pending))) as executor:
+            while True:
+                try:
+                    resps = list(executor.map(lambda id_: describe(Id=id_), pending))
+                except Exception:
+                    # throttling, a dropped connection... nobody will be polling these anymore
+                    self._cancel(pending)
+                    raise
+                # go through the whole tick before raising so every status is up to date
+                failure: Optional[Exception] = None
+                still_pending = []
+                for id_, resp in zip(pending, resps):
+                    self.statuses[id_] = resp["Status"].upper()
+                    try:
+                        if self._client._check_status(id_, resp) is None:
+                            still_pending.append(id_)
+                    except (RedshiftQueryException, RuntimeError) as ex:
+                        failure = failure or ex
+                pending = still_pending
+                if failure is not None:
+                    # the others would keep holding active statement slots for nothing
+                    self._cancel(pending)
+                    raise failure
+                if len(pending) <= max_pending:
+                    return len(pending)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                time.sleep(min(sleep_time, remaining))
+                sleep_time = min(sleep_time * _POLL_BACKOFF, _MAX_POLL_SECONDS)
+        self._cancel(pending)
+        raise RuntimeError(
+            f"queries [{', '.join(pending)}] timed out after [{time.monotonic() - start:.1f}s]"
+        )
+
+    def cancel(self) -> None:
+        """Cancel every statement not known to have finished"""
+        self._cancel(self._pending())
+
+    def _pending(self) -> List[str]:
+        return [id_ for id_, status in self.statuses.items() if status != "FINISHED"]
+
+    def _cancel(self, ids: List[str]) -> None:
+        for id_ in ids:
+            self._client._cancel(id_)
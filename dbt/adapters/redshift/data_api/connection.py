@@ -1,18 +1,112 @@
 from dbt.adapters.redshift.data_api.client import RedshiftDataClient
-from typing import Optional, NamedTuple, List, Dict, Any
+from itertools import islice
+from typing import Optional, NamedTuple, List, Dict, Any, Tuple, Callable, Iterator
+import functools
+import re
 import boto3
+import botocore.session
+from botocore.client import BaseClient
+from botocore.config import Config
+from botocore.credentials import DeferredRefreshableCredentials, create_assume_role_refresher
+from botocore.parsers import JSONParser, ResponseParserFactory
 from redshift_connector.utils.oids import RedshiftOID
 
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
 
-def _tracer(f):
-    def wrapper(*args, **kwargs):
-        try:
-            print("enter", f.name)
-            return f(*args, **kwargs)
-        finally:
-            print("exit", f.name)
 
-    return wrapper
+# clients are thread safe and hold their own connection pool, share them across connections.
+# polling hits the same endpoint over and over, keep its connections alive between calls
+_CLIENT_CONFIG = Config(
+    max_pool_connections=64,
+    tcp_keepalive=True,
+    connect_timeout=3,
+    # result pages can be large, leave room to read them
+    read_timeout=30,
+    retries={"mode": "adaptive"},
+)
+
+
+# any integer outside the 64 bit range has at least 19 digits,
+# e.g. -9223372036854775809 just below the signed minimum
+_LONG_DIGIT_RUN = re.compile(rb"\d{19}")
+
+
+class _OrjsonParser(JSONParser):
+    """Parses json protocol bodies, which is what redshift-data speaks, with orjson as it is
+    much faster on large Records pages. Integers and floats come out the same as with the stdlib:
+    orjson turns integers past 64 bits into floats, so bodies that may hold one, and bodies
+    orjson rejects, go through the stdlib parser"""
+
+    def _parse_body_as_json(self, body_contents):
+        if body_contents and not _LONG_DIGIT_RUN.search(body_contents):
+            try:
+                return orjson.loads(body_contents)
+            except ValueError:
+                pass
+        return super()._parse_body_as_json(body_contents)
+
+
+class _ResponseParserFactory(ResponseParserFactory):
+    def create_parser(self, protocol_name):
+        if protocol_name == "json":
+            return _OrjsonParser(**self._defaults)
+        return super().create_parser(protocol_name)
+
+
+def _new_session() -> boto3.session.Session:
+    """A boto3 session whose clients parse json responses with orjson when it is installed"""
+    botocore_session = botocore.session.get_session()
+    if orjson is not None:
+        botocore_session.register_component("response_parser_factory", _ResponseParserFactory())
+    return boto3.session.Session(botocore_session=botocore_session)
+
+
+def _session_client(session: boto3.session.Session, region: Optional[str]) -> BaseClient:
+    return session.client("redshift-data", region_name=region, config=_CLIENT_CONFIG)
+
+
+def _assume_role_refresher(sts: BaseClient, iam_role: str) -> Callable[[], Dict[str, Any]]:
+    """Assumes iam_role in the caller's account each time credentials need refreshing"""
+    role_arn: Optional[str] = None
+
+    def refresh() -> Dict[str, Any]:
+        nonlocal role_arn
+        if role_arn is None:
+            account = sts.get_caller_identity()["Account"]
+            role_arn = f"arn:aws:iam::{account}:role/{iam_role}"
+        return create_assume_role_refresher(
+            sts, {"RoleArn": role_arn, "RoleSessionName": "dbt-redshift"}
+        )()
+
+    return refresh
+
+
+@functools.lru_cache(maxsize=8)
+def _get_client(region: Optional[str], iam_role: Optional[str]) -> BaseClient:
+    """A shared redshift-data client per region and role. Assumed role credentials are
+    deferred and refreshed by botocore itself before they expire, so the client stays usable
+    for as long as it is cached"""
+    session = _new_session()
+    if iam_role:
+        sts = session.client("sts", region_name=region)
+        # boto3 has no public way to give a session refreshable credentials
+        session._session._credentials = DeferredRefreshableCredentials(
+            refresh_using=_assume_role_refresher(sts, iam_role), method="assume-role"
+        )
+    return _session_client(session, region)
+
+
+_TYPE_CODES = {
+    "LONG": RedshiftOID.BIGINT,
+    "DOUBLE": RedshiftOID.DECIMAL,
+    "STRING": RedshiftOID.VARCHAR,
+    "BOOLEAN": RedshiftOID.BOOLEAN,
+    "BLOB": RedshiftOID.VARCHAR,
+}
+_DEFAULT_TYPE_CODE = _TYPE_CODES["STRING"]
 
 
 class Column(NamedTuple):
@@ -28,13 +122,20 @@ class Column(NamedTuple):
 class Cursor:
     def __init__(self, client: RedshiftDataClient) -> None:
         self._cl = client
-        self._described = None
-        self._query_id = None
-        self._result_set = None
+        self._described: Optional[List[Column]] = None
+        self._query_id: Optional[str] = None
+        self._result_set: Optional[Iterator[Tuple]] = None
         self._column_metadata: Optional[List[Dict[str, Any]]] = None
+        # first page fetched for the description, kept so row iteration starts from it
+        self._prefetched: Optional[Tuple[str, Dict[str, Any]]] = None
 
     def execute(self, operation, *args, **kwargs):
         self._query_id = self._cl.execute_sql(operation, True)
+        # forget everything about the previous query
+        self._described = None
+        self._result_set = None
+        self._column_metadata = None
+        self._prefetched = None
         return self
 
     def _iter_result_set(self):
@@ -48,37 +149,41 @@ class Cursor:
         row = next(self._result_set)
         return row
 
+    def fetchmany(self, size: int = 1):
+        if self._result_set is None:
+            assert self._query_id is not None, "no query executed"
+            self._get_result_set(self._query_id)
+        assert self._result_set is not None
+        return list(islice(self._result_set, size))
+
     def fetchall(self):
         if self._result_set is None:
             self._get_result_set(self._query_id)
-        return [c for c in self._result_set]
+        # the result set is a lazy map over raw records, list() decodes the remaining rows
+        return list(self._result_set)
 
     @property
     def rowcount(self):
         return self._cl.row_count(self._query_id)
 
     def _get_result_set(self, query_id: str):
-        meta, cursor = self._cl.result_set(query_id)
+        meta, cursor = self._cl.result_set(query_id, self._prefetched)
         self._column_metadata = meta
         self._result_set = cursor
+        self._prefetched = None
 
     def _get_description(self, query_id: str):
-        type_code_map = {
-            "LONG": RedshiftOID.BIGINT,
-            "DOUBLE": RedshiftOID.DECIMAL,
-            "STRING": RedshiftOID.VARCHAR,
-            "BOOLEAN": RedshiftOID.BOOLEAN,
-            "BLOB": RedshiftOID.VARCHAR,
-        }
-        # need to fetch at least one row
+        # the columns come with the first page, no need to set up row iteration
         if self._column_metadata is None:
-            self._get_result_set(query_id)
+            self._prefetched = self._cl.first_page(query_id)
+            self._column_metadata = self._prefetched[1]["ColumnMetadata"]
+        type_code = _TYPE_CODES.get
         return [
             # figure this out
             # name # type_code # display_size # internal_size # precision # scale # null_ok
             Column(
                 column["name"],
-                type_code_map.get(column["typeName"].upper(), type_code_map["STRING"]),
+                type_code(column["typeName"].upper(), _DEFAULT_TYPE_CODE),
                 column["length"],
                 column["length"],
                 column["precision"],
@@ -92,8 +197,9 @@ class Cursor:
     def description(self):
         if not self._query_id:
             raise RuntimeError("Must have executed at least one query before")
-        metadata = self._get_description(self._query_id)
-        return metadata
+        if self._described is None:
+            self._described = self._get_description(self._query_id)
+        return self._described
 
     def __enter__(self) -> "Cursor":
         return self
@@ -113,25 +219,10 @@ class DataApiConnection:
         workgroup: Optional[str] = None,
         secret_arn: Optional[str] = None,
         iam_role: Optional[str] = None,
+        region: Optional[str] = None,
         **kwargs,
     ) -> None:
-        if iam_role:
-            sts = boto3.client("sts")
-            account = sts.get_caller_identity()["Account"]
-            role_arn = f"arn:aws:iam::{account}:role/{iam_role}"
-            creds = sts.assume_role(RoleArn=role_arn, RoleSessionName="dbt-redshift")[
-                "Credentials"
-            ]
-            creds = {
-                "aws_access_key_id": creds["AccessKeyId"],
-                "aws_secret_access_key": creds["SecretAccessKey"],
-                "aws_session_token": creds["SessionToken"],
-            }
-            sess = boto3.Session(**creds)
-            client = sess.client("redshift-data")
-        else:
-            client = None
-
+        client = _get_client(region, iam_role)
         self.cl = RedshiftDataClient(
             database,
             client,
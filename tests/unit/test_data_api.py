@@ -0,0 +1,574 @@
+import gc
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase, mock, skipIf
+
+from botocore.credentials import DeferredRefreshableCredentials
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from dbt.adapters.redshift.data_api import connection
+from dbt.adapters.redshift.data_api.client import (
+    RedshiftDataClient,
+    RedshiftQueryException,
+    WaitGroup,
+)
+from dbt.adapters.redshift.data_api.connection import Cursor
+
+
+class _FakeClock:
+    """Stands in for the time module of the client, sleeping advances the clock"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def __enter__(self):
+        self._patch = mock.patch("dbt.adapters.redshift.data_api.client.time", self)
+        self._patch.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._patch.stop()
+        return False
+
+
+class TestRedshiftDataClientWait(TestCase):
+    def setUp(self):
+        self.boto_client = mock.MagicMock()
+        self.client = RedshiftDataClient("dev", self.boto_client, workgroup="wg")
+
+    @mock.patch("dbt.adapters.redshift.data_api.client.time.sleep")
+    def test_wait_backs_off_exponentially(self, sleep):
+        self.boto_client.describe_statement.side_effect = [
+            {"Status": "SUBMITTED"},
+            {"Status": "STARTED"},
+            {"Status": "STARTED"},
+            {"Status": "FINISHED", "Id": "abc"},
+        ]
+        self.client._wait("abc", timeout_seconds=60)
+        sleeps = [c.args[0] for c in sleep.call_args_list]
+        self.assertEqual(len(sleeps), 3)
+        self.assertAlmostEqual(sleeps[0], 0.05)
+        self.assertTrue(sleeps[0] < sleeps[1] < sleeps[2] <= 2.0)
+
+    @mock.patch("dbt.adapters.redshift.data_api.client.time.sleep")
+    def test_wait_raises_on_failure(self, sleep):
+        self.boto_client.describe_statement.return_value = {"Status": "FAILED", "Error": "boom"}
+        with self.assertRaises(RedshiftQueryException):
+            self.client._wait("abc")
+        sleep.assert_not_called()
+
+    @mock.patch("dbt.adapters.redshift.data_api.client.time.sleep")
+    def test_wait_cancels_statement_on_timeout(self, sleep):
+        self.boto_client.describe_statement.return_value = {"Status": "STARTED"}
+        with self.assertRaises(RuntimeError):
+            self.client._wait("abc", timeout_seconds=0)
+        self.boto_client.cancel_statement.assert_called_once_with(Id="abc")
+
+    @mock.patch("dbt.adapters.redshift.data_api.client.time.sleep")
+    def test_wait_ignores_cancel_client_errors(self, sleep):
+        self.boto_client.describe_statement.return_value = {"Status": "STARTED"}
+        self.boto_client.cancel_statement.side_effect = ClientError(
+            {"Error": {"Code": "ValidationException"}}, "CancelStatement"
+        )
+        with self.assertRaisesRegex(RuntimeError, "timed out"):
+            self.client._wait("abc", timeout_seconds=0)
+
+
+class TestRedshiftDataClientExecute(TestCase):
+    def setUp(self):
+        self.boto_client = mock.MagicMock()
+        self.client = RedshiftDataClient("dev", self.boto_client, workgroup="wg")
+
+    @staticmethod
+    def _quota_error(headers=None):
+        return ClientError(
+            {
+                "Error": {"Code": "ActiveStatementsExceededException"},
+                "ResponseMetadata": {"HTTPHeaders": headers or {}},
+            },
+            "BatchExecuteStatement",
+        )
+
+    def test_quota_backoff_grows(self):
+        self.boto_client.batch_execute_statement.side_effect = [
+            self._quota_error(),
+            self._quota_error(),
+            self._quota_error({"retry-after": "3"}),
+            {"Id": "abc"},
+        ]
+
+        with _FakeClock() as clock:
+            self.assertEqual(self.client.execute_sql("select 1", wait=False), "abc")
+
+        self.assertTrue(0.5 <= clock.sleeps[0] <= 0.75)
+        self.assertTrue(1.0 <= clock.sleeps[1] <= 1.25)
+        self.assertEqual(clock.sleeps[2], 3.0)
+
+    def test_quota_backoff_respects_timeout(self):
+        self.boto_client.batch_execute_statement.side_effect = self._quota_error()
+
+        with _FakeClock() as clock:
+            with self.assertRaisesRegex(RuntimeError, "ActiveStatementsExceededException"):
+                self.client.execute_sql("select 1", wait=False, timeout_seconds=5)
+
+        self.assertAlmostEqual(sum(clock.sleeps), 5)
+
+    def test_quota_backoff_ignores_zero_retry_after(self):
+        self.boto_client.batch_execute_statement.side_effect = self._quota_error(
+            {"retry-after": "0"}
+        )
+
+        with _FakeClock() as clock:
+            with self.assertRaisesRegex(RuntimeError, "ActiveStatementsExceededException"):
+                self.client.execute_sql("select 1", wait=False, timeout_seconds=1)
+
+        self.assertTrue(all(delay > 0 for delay in clock.sleeps))
+        self.assertLess(self.boto_client.batch_execute_statement.call_count, 5)
+
+
+class TestRedshiftDataClientResultSet(TestCase):
+    def setUp(self):
+        self.boto_client = mock.MagicMock()
+        self.boto_client.get_statement_result.return_value = {
+            "ColumnMetadata": [{"name": "a", "typeName": "int4"}],
+            "Records": [[{"longValue": 1}], [{"isNull": True}]],
+        }
+        self.client = RedshiftDataClient("dev", self.boto_client, workgroup="wg")
+
+    def test_result_set_reuses_id_resolved_by_wait(self):
+        self.boto_client.describe_statement.return_value = {
+            "Status": "FINISHED",
+            "Id": "abc",
+            "SubStatements": [{"Id": "abc:1"}, {"Id": "abc:2"}],
+        }
+        self.client._wait("abc")
+        self.boto_client.describe_statement.reset_mock()
+
+        meta, rows = self.client.result_set("abc")
+
+        self.boto_client.describe_statement.assert_not_called()
+        self.boto_client.get_statement_result.assert_called_once_with(Id="abc:2")
+        self.assertEqual(list(rows), [(1,), (None,)])
+
+    def test_result_set_describes_unknown_id(self):
+        self.boto_client.describe_statement.return_value = {"Id": "abc", "SubStatements": []}
+
+        self.client.result_set("abc")
+
+        self.boto_client.describe_statement.assert_called_once_with(Id="abc")
+        self.boto_client.get_statement_result.assert_called_once_with(Id="abc")
+
+    def test_result_set_iterates_all_pages(self):
+        self.boto_client.describe_statement.return_value = {"Id": "abc"}
+        self.boto_client.get_statement_result.side_effect = [
+            {
+                "ColumnMetadata": [{"name": "a", "typeName": "int4"}],
+                "Records": [[{"longValue": 1}]],
+                "NextToken": "t1",
+            },
+            {"Records": [[{"longValue": 2}]], "NextToken": "t2"},
+            {"Records": [[{"longValue": 3}]]},
+        ]
+
+        _, rows = self.client.result_set("abc")
+
+        self.assertEqual(list(rows), [(1,), (2,), (3,)])
+        self.assertEqual(
+            self.boto_client.get_statement_result.call_args_list,
+            [
+                mock.call(Id="abc"),
+                mock.call(Id="abc", NextToken="t1"),
+                mock.call(Id="abc", NextToken="t2"),
+            ],
+        )
+
+    def test_closing_rows_early_does_not_wait_for_prefetch(self):
+        release = threading.Event()
+
+        def get_statement_result(Id, NextToken=None):
+            if NextToken is None:
+                return {
+                    "ColumnMetadata": [{"name": "a", "typeName": "int4"}],
+                    "Records": [[{"longValue": 1}], [{"longValue": 2}]],
+                    "NextToken": "t1",
+                }
+            release.wait(5)
+            return {"Records": [[{"longValue": 3}]]}
+
+        self.boto_client.describe_statement.return_value = {"Id": "abc"}
+        self.boto_client.get_statement_result.side_effect = get_statement_result
+        _, rows = self.client.result_set("abc")
+        self.assertEqual(next(rows), (1,))
+
+        start = time.monotonic()
+        del rows
+        gc.collect()
+        self.assertLess(time.monotonic() - start, 1)
+        release.set()
+
+    def test_result_set_decodes_fields(self):
+        self.boto_client.describe_statement.return_value = {"Id": "abc"}
+        self.boto_client.get_statement_result.return_value = {
+            "ColumnMetadata": [
+                {"name": "a", "typeName": "int8"},
+                {"name": "b", "typeName": "varchar"},
+                {"name": "c", "typeName": "super"},
+                {"name": "d", "typeName": "float8"},
+            ],
+            "Records": [
+                [
+                    {"longValue": 1},
+                    {"stringValue": "x"},
+                    {"stringValue": "{}"},
+                    {"doubleValue": 1.5},
+                ],
+                [{"isNull": True}, {"isNull": True}, {"isNull": True}, {"isNull": True}],
+                # the value key need not match the column type
+                [{"longValue": 2}, {"stringValue": "y"}, {"isNull": True}, {"longValue": 3}],
+            ],
+        }
+
+        _, rows = self.client.result_set("abc")
+
+        self.assertEqual(
+            list(rows),
+            [(1, "x", "{}", 1.5), (None, None, None, None), (2, "y", None, 3)],
+        )
+
+
+class TestRedshiftDataClientGather(TestCase):
+    def test_gather_submits_everything_before_waiting(self):
+        boto_client = mock.MagicMock()
+        boto_client.batch_execute_statement.side_effect = [{"Id": "a"}, {"Id": "b"}]
+        boto_client.describe_statement.side_effect = lambda Id: {"Status": "FINISHED", "Id": Id}
+        client = RedshiftDataClient("dev", boto_client, workgroup="wg")
+
+        ids = client.gather_execute_sqls([["select 1"], ["select 2"]])
+
+        self.assertEqual(ids, ["a", "b"])
+        self.assertEqual(
+            [c[0] for c in boto_client.method_calls],
+            [
+                "batch_execute_statement",
+                "batch_execute_statement",
+                "describe_statement",
+                "describe_statement",
+            ],
+        )
+
+    def test_gather_cancels_submitted_statements_when_a_submit_fails(self):
+        boto_client = mock.MagicMock()
+        boto_client.batch_execute_statement.side_effect = [
+            {"Id": "a"},
+            {"Id": "b"},
+            ClientError({"Error": {"Code": "ValidationException"}}, "BatchExecute"),
+            {"Id": "d"},
+        ]
+        client = RedshiftDataClient("dev", boto_client, workgroup="wg")
+
+        with self.assertRaises(ClientError):
+            client.gather_execute_sqls([["select 1"], ["select 2"], ["oops"], ["select 4"]])
+
+        self.assertEqual(
+            [c.kwargs["Id"] for c in boto_client.cancel_statement.call_args_list], ["a", "b"]
+        )
+        self.assertEqual(boto_client.batch_execute_statement.call_count, 3)
+        boto_client.describe_statement.assert_not_called()
+
+
+class TestWaitGroup(TestCase):
+    def setUp(self):
+        self.boto_client = mock.MagicMock()
+        self.client = RedshiftDataClient("dev", self.boto_client, workgroup="wg")
+
+    @mock.patch("dbt.adapters.redshift.data_api.client.time.sleep")
+    def test_wait_all_polls_pending_statements_per_tick(self, sleep):
+        statuses = {"a": iter(["STARTED", "FINISHED"]), "b": iter(["STARTED"] * 3 + ["FINISHED"])}
+        self.boto_client.describe_statement.side_effect = lambda Id: {
+            "Id": Id,
+            "Status": next(statuses[Id]),
+        }
+        group = WaitGroup(self.client, ["a", "b"])
+
+        group.wait_all()
+
+        self.assertEqual(group.statuses, {"a": "FINISHED", "b": "FINISHED"})
+        self.assertEqual(self.boto_client.describe_statement.call_count, 6)
+        self.assertEqual(sleep.call_count, 3)
+
+    @mock.patch("dbt.adapters.redshift.data_api.client.time.sleep")
+    def test_wait_all_raises_on_failure(self, sleep):
+        self.boto_client.describe_statement.side_effect = lambda Id: {
+            "Id": Id,
+            "Status": "FAILED" if Id == "b" else "STARTED",
+            "Error": "boom",
+        }
+        with self.assertRaises(RedshiftQueryException):
+            WaitGroup(self.client, ["a", "b"]).wait_all()
+
+    @mock.patch("dbt.adapters.redshift.data_api.client.time.sleep")
+    def test_wait_all_cancels_pending_when_a_sibling_fails(self, sleep):
+        self.boto_client.describe_statement.side_effect = lambda Id: {
+            "Id": Id,
+            "Status": {"a": "FINISHED", "b": "FAILED", "c": "STARTED"}[Id],
+            "Error": "boom",
+        }
+        group = WaitGroup(self.client, ["a", "b", "c"])
+
+        with self.assertRaises(RedshiftQueryException):
+            group.wait_all()
+
+        self.assertEqual(group.statuses, {"a": "FINISHED", "b": "FAILED", "c": "STARTED"})
+        self.boto_client.cancel_statement.assert_called_once_with(Id="c")
+
+    def test_wait_all_cancels_pending_when_describe_fails(self):
+        self.boto_client.describe_statement.side_effect = EndpointConnectionError(
+            endpoint_url="https://redshift-data"
+        )
+        with self.assertRaises(EndpointConnectionError):
+            WaitGroup(self.client, ["a", "b"]).wait_all()
+        self.assertEqual(
+            sorted(c.kwargs["Id"] for c in self.boto_client.cancel_statement.call_args_list),
+            ["a", "b"],
+        )
+
+    @mock.patch("dbt.adapters.redshift.data_api.client.time.sleep")
+    def test_wait_all_cancels_pending_on_timeout(self, sleep):
+        self.boto_client.describe_statement.side_effect = lambda Id: {
+            "Id": Id,
+            "Status": "FINISHED" if Id == "a" else "STARTED",
+        }
+        with self.assertRaisesRegex(RuntimeError, "timed out"):
+            WaitGroup(self.client, ["a", "b"]).wait_all(timeout_seconds=0)
+        self.boto_client.cancel_statement.assert_called_once_with(Id="b")
+
+
+class TestGetClient(TestCase):
+    def setUp(self):
+        connection._get_client.cache_clear()
+        self.addCleanup(connection._get_client.cache_clear)
+
+    def test_client_is_shared(self):
+        client = connection._get_client("us-east-1", None)
+
+        self.assertIs(connection._get_client("us-east-1", None), client)
+        self.assertIsNot(connection._get_client("us-west-2", None), client)
+
+    def test_role_client_refreshes_its_own_credentials(self):
+        # creating the client must not call sts, credentials are only fetched when needed
+        client = connection._get_client("us-east-1", "role")
+
+        self.assertIsInstance(client._request_signer._credentials, DeferredRefreshableCredentials)
+
+    def test_assume_role_refresher(self):
+        sts = mock.MagicMock()
+        sts.get_caller_identity.return_value = {"Account": "123"}
+        sts.assume_role.return_value = {
+            "Credentials": {
+                "AccessKeyId": "key",
+                "SecretAccessKey": "secret",
+                "SessionToken": "token",
+                "Expiration": datetime.now(timezone.utc) + timedelta(hours=1),
+            }
+        }
+        refresh = connection._assume_role_refresher(sts, "role")
+
+        self.assertEqual(refresh()["access_key"], "key")
+        refresh()
+
+        sts.get_caller_identity.assert_called_once_with()
+        self.assertEqual(
+            sts.assume_role.call_args_list,
+            [mock.call(RoleArn="arn:aws:iam::123:role/role", RoleSessionName="dbt-redshift")] * 2,
+        )
+
+
+class TestRedshiftDataClientBatched(TestCase):
+    def test_batched_splits_into_batches(self):
+        boto_client = mock.MagicMock()
+        boto_client.batch_execute_statement.side_effect = lambda **kwargs: {
+            "Id": kwargs["Sqls"][0]
+        }
+        boto_client.describe_statement.side_effect = lambda Id: {"Status": "FINISHED", "Id": Id}
+        client = RedshiftDataClient("dev", boto_client, workgroup="wg")
+        sqls = [f"select {i}" for i in range(90)]
+
+        group = client.execute_sqls_batched(sqls, concurrency=3)
+
+        self.assertEqual(group.ids, ["select 0", "select 40", "select 80"])
+        self.assertEqual(set(group.statuses.values()), {"FINISHED"})
+        batches = sorted(
+            (c.kwargs["Sqls"] for c in boto_client.batch_execute_statement.call_args_list),
+            key=len,
+        )
+        self.assertEqual([len(b) for b in batches], [10, 40, 40])
+
+    @mock.patch("dbt.adapters.redshift.data_api.client.time.sleep")
+    def test_batched_bounds_batches_in_flight(self, sleep):
+        boto_client = mock.MagicMock()
+        running = set()
+        most_running = 0
+        polled = set()
+
+        def batch_execute_statement(**kwargs):
+            nonlocal most_running
+            id_ = kwargs["Sqls"][0]
+            running.add(id_)
+            most_running = max(most_running, len(running))
+            return {"Id": id_}
+
+        def describe_statement(Id):
+            # each statement is still running the first time it is polled
+            if Id not in polled:
+                polled.add(Id)
+                return {"Id": Id, "Status": "STARTED"}
+            running.discard(Id)
+            return {"Id": Id, "Status": "FINISHED"}
+
+        boto_client.batch_execute_statement.side_effect = batch_execute_statement
+        boto_client.describe_statement.side_effect = describe_statement
+        client = RedshiftDataClient("dev", boto_client, workgroup="wg")
+        sqls = [f"select {i}" for i in range(10)]
+
+        group = client.execute_sqls_batched(sqls, concurrency=2, batch_size=2)
+
+        self.assertEqual(group.ids, [f"select {i}" for i in range(0, 10, 2)])
+        self.assertEqual(set(group.statuses.values()), {"FINISHED"})
+        self.assertEqual(most_running, 2)
+
+    def test_batched_submit_and_wait_share_the_timeout(self):
+        boto_client = mock.MagicMock()
+        client = RedshiftDataClient("dev", boto_client, workgroup="wg")
+
+        with _FakeClock() as clock:
+
+            # the second batch can't get an active statement slot for 6 seconds
+            def batch_execute_statement(**kwargs):
+                if kwargs["Sqls"] == ["select 2"] and clock.now < 6:
+                    raise TestRedshiftDataClientExecute._quota_error()
+                return {"Id": kwargs["Sqls"][0]}
+
+            boto_client.batch_execute_statement.side_effect = batch_execute_statement
+            boto_client.describe_statement.side_effect = lambda Id: {"Id": Id, "Status": "STARTED"}
+            with self.assertRaisesRegex(RuntimeError, "timed out"):
+                client.execute_sqls_batched(
+                    ["select 1", "select 2"], concurrency=2, batch_size=1, timeout_seconds=10
+                )
+
+        # waiting only got what submitting left of the timeout
+        self.assertAlmostEqual(clock.now, 10)
+        self.assertEqual(
+            sorted(c.kwargs["Id"] for c in boto_client.cancel_statement.call_args_list),
+            ["select 1", "select 2"],
+        )
+
+    def test_batched_cancels_submitted_batches_when_a_submit_fails(self):
+        boto_client = mock.MagicMock()
+        first_submitted = threading.Event()
+
+        def batch_execute_statement(**kwargs):
+            if kwargs["Sqls"][0] == "select 40":
+                first_submitted.wait(1)
+                raise ClientError({"Error": {"Code": "ValidationException"}}, "BatchExecute")
+            first_submitted.set()
+            return {"Id": kwargs["Sqls"][0]}
+
+        boto_client.batch_execute_statement.side_effect = batch_execute_statement
+        client = RedshiftDataClient("dev", boto_client, workgroup="wg")
+        sqls = [f"select {i}" for i in range(90)]
+
+        with self.assertRaises(ClientError):
+            client.execute_sqls_batched(sqls, concurrency=3)
+
+        # batches queued behind the failing one may or may not have started
+        submitted = {
+            c.kwargs["Sqls"][0] for c in boto_client.batch_execute_statement.call_args_list
+        }
+        self.assertIn("select 0", submitted)
+        self.assertEqual(
+            sorted(c.kwargs["Id"] for c in boto_client.cancel_statement.call_args_list),
+            sorted(submitted - {"select 40"}),
+        )
+        boto_client.describe_statement.assert_not_called()
+
+
+class TestCursor(TestCase):
+    def setUp(self):
+        self.boto_client = mock.MagicMock()
+        self.boto_client.batch_execute_statement.side_effect = [{"Id": "q1"}, {"Id": "q2"}]
+        self.boto_client.describe_statement.side_effect = lambda Id: {
+            "Status": "FINISHED",
+            "Id": Id,
+        }
+        self.boto_client.get_statement_result.side_effect = lambda Id: {
+            "ColumnMetadata": [
+                {
+                    "name": Id,
+                    "typeName": "int4",
+                    "length": 0,
+                    "precision": 10,
+                    "scale": 0,
+                    "nullable": 1,
+                }
+            ],
+            "Records": [[{"longValue": 1}], [{"longValue": 2}]],
+        }
+        self.cursor = Cursor(RedshiftDataClient("dev", self.boto_client, workgroup="wg"))
+
+    def test_description_is_memoized_per_query(self):
+        self.cursor.execute("select 1")
+        first = self.cursor.description
+        self.assertIs(self.cursor.description, first)
+        self.assertEqual(first[0].name, "q1")
+
+        self.cursor.execute("select 2")
+        self.assertEqual(self.cursor.description[0].name, "q2")
+        self.assertEqual(self.cursor.fetchall(), [(1,), (2,)])
+
+    def test_fetchmany(self):
+        self.cursor.execute("select 1")
+        self.assertEqual(self.cursor.fetchmany(), [(1,)])
+        self.assertEqual(self.cursor.fetchmany(5), [(2,)])
+        self.assertEqual(self.cursor.fetchmany(5), [])
+
+    def test_description_page_is_reused_for_rows(self):
+        self.cursor.execute("select 1")
+        self.assertEqual([c.name for c in self.cursor.description], ["q1"])
+        self.assertEqual(self.cursor.fetchall(), [(1,), (2,)])
+
+        self.boto_client.get_statement_result.assert_called_once_with(Id="q1")
+        self.boto_client.describe_statement.assert_called_once_with(Id="q1")
+
+
+@skipIf(connection.orjson is None, "orjson is not installed")
+class TestOrjsonParser(TestCase):
+    def test_session_uses_orjson_parser(self):
+        client = connection._new_session().client("redshift-data", region_name="us-east-1")
+        parser = client._endpoint._response_parser_factory.create_parser("json")
+        self.assertIsInstance(parser, connection._OrjsonParser)
+
+    def test_parses_like_stdlib(self):
+        parser = connection._OrjsonParser()
+        body = b'{"Records": [[{"longValue": 9223372036854775807}, {"doubleValue": 0.1}]]}'
+        self.assertEqual(
+            parser._parse_body_as_json(body),
+            {"Records": [[{"longValue": 9223372036854775807}, {"doubleValue": 0.1}]]},
+        )
+        self.assertEqual(parser._parse_body_as_json(b""), {})
+
+    def test_falls_back_to_stdlib(self):
+        parser = connection._OrjsonParser()
+        self.assertEqual(parser._parse_body_as_json(b'{"a": 1' + b"0" * 30 + b"}"), {"a": 10**30})
+        self.assertEqual(
+            parser._parse_body_as_json(b'{"a": -9223372036854775809}'), {"a": -9223372036854775809}
+        )
+        self.assertEqual(parser._parse_body_as_json(b"not json"), {"message": "not json"})